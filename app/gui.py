@@ -3,7 +3,7 @@ import os
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QFileDialog, QSpinBox, QDoubleSpinBox,
-    QGroupBox, QProgressBar, QStatusBar, QMessageBox
+    QGroupBox, QProgressBar, QStatusBar, QMessageBox, QCheckBox
 )
 from PySide6.QtCore import Qt, QThread, Signal, QUrl
 from PySide6.QtMultimedia import QMediaPlayer
@@ -24,6 +24,7 @@ class ProcessingThread(QThread):
     """Exécute le traitement vidéo dans un thread séparé."""
     finished = Signal(str, str)  # Signaux : output_path, error_message
     status_update = Signal(str)
+    progress = Signal(int)  # Pourcentage d'avancement
 
     def __init__(self, input_file, output_dir, params):
         super().__init__()
@@ -45,7 +46,11 @@ class ProcessingThread(QThread):
                 self.params["levels"],
                 self.params["low_freq"],
                 self.params["high_freq"],
-                self.params["alpha"]
+                self.params["alpha"],
+                # Les pyramides ne dépendent que de la vidéo et du nombre de niveaux : on les réutilise
+                # quand seuls alpha ou les fréquences changent (seule la dernière vidéo reste sur disque)
+                use_pyramid_cache=self.params["use_cache"],
+                progress_callback=self.progress.emit
             )
 
             if output_path:
@@ -99,6 +104,8 @@ class MotionMagnificationApp(QMainWindow):
         self.high_freq_spin.setRange(0.1, 20.0); self.high_freq_spin.setValue(1.0); self.high_freq_spin.setDecimals(2); self.high_freq_spin.setSingleStep(0.1)
         self.alpha_spin = QDoubleSpinBox()
         self.alpha_spin.setRange(1, 500); self.alpha_spin.setValue(50); self.alpha_spin.setDecimals(1); self.alpha_spin.setSingleStep(10)
+        self.cache_check = QCheckBox("Réutiliser les pyramides (cache disque)")
+        self.cache_check.setChecked(False)
         evm_layout.addWidget(QLabel("Niveaux de la pyramide :"))
         evm_layout.addWidget(self.levels_spin)
         evm_layout.addWidget(QLabel("Fréquence de coupure basse (Hz) :"))
@@ -107,6 +114,7 @@ class MotionMagnificationApp(QMainWindow):
         evm_layout.addWidget(self.high_freq_spin)
         evm_layout.addWidget(QLabel("Facteur d'amplification (alpha) :"))
         evm_layout.addWidget(self.alpha_spin)
+        evm_layout.addWidget(self.cache_check)
         self.evm_params_group.setLayout(evm_layout)
         left_panel.addWidget(self.evm_params_group)
 
@@ -196,7 +204,8 @@ class MotionMagnificationApp(QMainWindow):
             "levels": self.levels_spin.value(),
             "low_freq": self.low_freq_spin.value(),
             "high_freq": self.high_freq_spin.value(),
-            "alpha": self.alpha_spin.value()
+            "alpha": self.alpha_spin.value(),
+            "use_cache": self.cache_check.isChecked()
         }
 
         # S'assure que le répertoire de résultats existe
@@ -205,11 +214,13 @@ class MotionMagnificationApp(QMainWindow):
 
         self.process_button.setEnabled(False)
         self.progress_bar.setVisible(True)
-        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
         self.status_bar.showMessage("Traitement en cours...")
 
         self.processing_thread = ProcessingThread(self.input_video_path, output_dir, params)
         self.processing_thread.status_update.connect(self.status_bar.showMessage)
+        self.processing_thread.progress.connect(self.progress_bar.setValue)
         self.processing_thread.finished.connect(self.on_processing_finished)
         self.processing_thread.start()
 
@@ -1,21 +1,91 @@
+import threading
 import cv2
 import numpy as np
 
-def build_gaussian_pyramid(image, levels):
-    """Builds a Gaussian pyramid for an image."""
-    pyramid = [image]
+# Numba is optional, it backs the opt-in JIT-compiled parallel pyramid collapse
+try:
+    from numba import njit, prange
+    from numba.typed import List as NumbaList
+    NUMBA_AVAILABLE = True
+    # Frames collapsed per Numba call, should stay well above the core count
+    NUMBA_COLLAPSE_CHUNK = 32
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# OpenCV's transparent API (cv2.UMat) runs on OpenCL when a device is present; it is only switched on
+# by the use_opencl path, never at import
+OPENCL_AVAILABLE = cv2.ocl.haveOpenCL()
+
+# The CUDA path needs an OpenCV build with the cudawarping module and a visible device
+try:
+    CUDA_AVAILABLE = hasattr(cv2.cuda, "pyrDown") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+except (AttributeError, cv2.error):
+    CUDA_AVAILABLE = False
+
+# Per-thread scratch buffers for build_*_pyramid(reuse_buffers=True)
+_thread_buffers = threading.local()
+
+def pyramid_sizes(width, height, levels):
+    """Returns the (width, height) of every pyramid level, following cv2.pyrDown's rounding."""
+    sizes = [(width, height)]
     for _ in range(levels - 1):
-        image = cv2.pyrDown(image)
+        width, height = (width + 1) // 2, (height + 1) // 2
+        sizes.append((width, height))
+    return sizes
+
+def _pooled_buffer(key, shape, dtype):
+    """Returns this thread's reusable buffer for `key`, reallocated only if the shape or type changes."""
+    pool = getattr(_thread_buffers, "pool", None)
+    if pool is None:
+        pool = _thread_buffers.pool = {}
+    buffer = pool.get(key)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = pool[key] = np.empty(shape, dtype=dtype)
+    return buffer
+
+def build_gaussian_pyramid(image, levels, sizes=None, reuse_buffers=False):
+    """
+    Builds a Gaussian pyramid for an image (ndarray, or cv2.UMat if sizes is given), with level sizes from pyramid_sizes unless given.
+
+    With reuse_buffers, the levels are written into per-thread buffers that the next call on the same
+    thread overwrites.
+    """
+    if sizes is None:
+        sizes = pyramid_sizes(image.shape[1], image.shape[0], levels)
+    pyramid = [image]
+    for level_idx in range(levels - 1):
+        dst = None
+        if reuse_buffers:
+            width, height = sizes[level_idx+1]
+            dst = _pooled_buffer(("gaussian", level_idx+1), (height, width) + image.shape[2:], image.dtype)
+        image = cv2.pyrDown(image, dst=dst, dstsize=sizes[level_idx+1])
         pyramid.append(image)
     return pyramid
 
-def build_laplacian_pyramid(image, levels):
-    """Builds a Laplacian pyramid for an image."""
-    gaussian_pyramid = build_gaussian_pyramid(image, levels)
+def build_laplacian_pyramid(image, levels, sizes=None, use_opencl=False, reuse_buffers=False):
+    """
+    Builds a Laplacian pyramid for an image, with level sizes from pyramid_sizes unless given.
+
+    With use_opencl, the image is wrapped in a cv2.UMat so OpenCV can run the pyramid through its
+    transparent OpenCL path; the levels are downloaded back to ndarrays at the end. With reuse_buffers,
+    the levels live in per-thread buffers valid until the next call on the same thread.
+    """
+    if sizes is None:
+        sizes = pyramid_sizes(image.shape[1], image.shape[0], levels)
+    if use_opencl:
+        # The OpenCL switch is per thread in OpenCV, so turn it on in the thread building this frame
+        if not cv2.ocl.useOpenCL():
+            cv2.ocl.setUseOpenCL(True)
+        return [level.get() for level in build_laplacian_pyramid(cv2.UMat(image), levels, sizes)]
+    gaussian_pyramid = build_gaussian_pyramid(image, levels, sizes, reuse_buffers=reuse_buffers)
     laplacian_pyramid = []
     for i in range(levels - 1):
-        upsampled = cv2.pyrUp(gaussian_pyramid[i+1], dstsize=(gaussian_pyramid[i].shape[1], gaussian_pyramid[i].shape[0]))
-        laplacian = cv2.subtract(gaussian_pyramid[i], upsampled)
+        dst = None
+        if reuse_buffers:
+            dst = _pooled_buffer(("laplacian", i), gaussian_pyramid[i].shape, gaussian_pyramid[i].dtype)
+        upsampled = cv2.pyrUp(gaussian_pyramid[i+1], dst=dst, dstsize=sizes[i])
+        # The difference overwrites the upsampled image in place
+        laplacian = cv2.subtract(gaussian_pyramid[i], upsampled, dst=upsampled)
         laplacian_pyramid.append(laplacian)
     # Add the smallest Gaussian level as the last level of the Laplacian pyramid
     laplacian_pyramid.append(gaussian_pyramid[-1])
@@ -32,4 +102,117 @@ def reconstruct_from_laplacian_pyramid(pyramid):
         term2 = pyramid[i].astype(np.float32)
         image = cv2.add(term1, term2)
         
-    return image
\ No newline at end of file
+    return image
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _pyr_up_5tap(src, out_height, out_width):
+        """Upsamples an (H, W, C) image like cv2.pyrUp with the separable [1, 4, 6, 4, 1] kernel."""
+        height, width, channels = src.shape
+        rows = np.empty((height, out_width, channels), dtype=np.float32)
+        for y in range(height):
+            for x in range(out_width):
+                sx = x // 2
+                left = src[y, abs(sx - 1) if width > 1 else 0]
+                center = src[y, sx]
+                right = src[y, sx + 1] if sx + 1 < width else center
+                for ch in range(channels):
+                    if x % 2 == 0:
+                        rows[y, x, ch] = left[ch] + 6.0 * center[ch] + right[ch]
+                    else:
+                        rows[y, x, ch] = 4.0 * (center[ch] + right[ch])
+
+        dst = np.empty((out_height, out_width, channels), dtype=np.float32)
+        for y in range(out_height):
+            sy = y // 2
+            top = rows[abs(sy - 1) if height > 1 else 0]
+            center = rows[sy]
+            bottom = rows[sy + 1] if sy + 1 < height else center
+            for x in range(out_width):
+                for ch in range(channels):
+                    if y % 2 == 0:
+                        dst[y, x, ch] = (top[x, ch] + 6.0 * center[x, ch] + bottom[x, ch]) * (1.0 / 64.0)
+                    else:
+                        dst[y, x, ch] = (center[x, ch] + bottom[x, ch]) * (4.0 / 64.0)
+        return dst
+
+    @njit(cache=True, parallel=True, fastmath=True)
+    def _collapse_laplacian_pyramid_numba(levels, out_frames):
+        """Collapses every frame of a temporal Laplacian pyramid in parallel over frames."""
+        num_levels = len(levels)
+        for i in prange(out_frames.shape[0]):
+            image = levels[num_levels - 1][i].copy()
+            for level_idx in range(num_levels - 2, -1, -1):
+                level = levels[level_idx][i]
+                image = _pyr_up_5tap(image, level.shape[0], level.shape[1])
+                image += level
+            out_frames[i] = image
+
+def reconstruct_from_laplacian_pyramid_batched(pyramid_video, out_frames, executor=None, use_numba=False):
+    """
+    Reconstructs every frame of a temporal Laplacian pyramid (list of (T, H, W, C) levels) into out_frames.
+
+    With an executor, frames are collapsed in parallel (cv2.pyrUp/add release the GIL), each worker
+    writing its own output frame. use_numba selects the JIT-compiled collapse instead of OpenCV.
+    """
+    # Levels may be stored as float16, the arithmetic is always done in float32
+    if use_numba and NUMBA_AVAILABLE and out_frames.ndim == 4:
+        # Numba has no float16 support, so upcast a few frames at a time to bound the extra memory
+        for start in range(0, len(out_frames), NUMBA_COLLAPSE_CHUNK):
+            stop = start + NUMBA_COLLAPSE_CHUNK
+            levels = NumbaList(np.ascontiguousarray(level[start:stop], dtype=np.float32) for level in pyramid_video)
+            _collapse_laplacian_pyramid_numba(levels, out_frames[start:stop])
+        return out_frames
+
+    def collapse_into(i):
+        image = pyramid_video[-1][i].astype(np.float32, copy=False)
+        for level_idx in range(len(pyramid_video) - 2, -1, -1):
+            level = pyramid_video[level_idx][i].astype(np.float32, copy=False)
+            upsampled = cv2.pyrUp(image, dstsize=(level.shape[1], level.shape[0]))
+            image = cv2.add(upsampled, level)
+        out_frames[i] = image
+
+    num_frames = len(pyramid_video[0])
+    if executor is not None and num_frames > 1:
+        list(executor.map(collapse_into, range(num_frames)))
+    else:
+        for i in range(num_frames):
+            collapse_into(i)
+    return out_frames
+
+def upload_frame_gpu(frame):
+    """Uploads a uint8 frame to the GPU and converts it there to float32 in [0, 1]."""
+    gpu_frame = cv2.cuda_GpuMat()
+    gpu_frame.upload(frame)
+    return gpu_frame.convertTo(cv2.CV_32FC(frame.shape[2] if frame.ndim == 3 else 1), alpha=1.0/255.0)
+
+def build_gaussian_pyramid_gpu(gpu_image, levels):
+    """Builds a Gaussian pyramid for an image resident on the GPU (GpuMat)."""
+    pyramid = [gpu_image]
+    for _ in range(levels - 1):
+        gpu_image = cv2.cuda.pyrDown(gpu_image)
+        pyramid.append(gpu_image)
+    return pyramid
+
+def build_laplacian_pyramid_gpu(gpu_image, levels, sizes=None):
+    """
+    Builds a Laplacian pyramid for an image resident on the GPU, keeping every level as a GpuMat.
+
+    Level sizes follow pyramid_sizes unless given. cuda.pyrDown already rounds like cv2.pyrDown, and
+    cuda.pyrUp (which has no dstsize) is cropped to the ladder, which matches cv2.pyrUp with dstsize.
+    """
+    if sizes is None:
+        sizes = pyramid_sizes(*gpu_image.size(), levels)
+    gaussian_pyramid = build_gaussian_pyramid_gpu(gpu_image, levels)
+    laplacian_pyramid = []
+    for i in range(levels - 1):
+        width, height = sizes[i]
+        upsampled = cv2.cuda.pyrUp(gaussian_pyramid[i+1])
+        # Crop the extra row/column produced for odd sizes
+        if upsampled.size() != (width, height):
+            upsampled = cv2.cuda_GpuMat(upsampled, (0, 0, width, height))
+        laplacian = cv2.cuda.subtract(gaussian_pyramid[i], upsampled)
+        laplacian_pyramid.append(laplacian)
+    # Add the smallest Gaussian level as the last level of the Laplacian pyramid
+    laplacian_pyramid.append(gaussian_pyramid[-1])
+    return laplacian_pyramid